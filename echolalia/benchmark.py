@@ -0,0 +1,312 @@
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from echolalia.parser import iMessageParser
+
+
+def directory_size(path: str) -> int:
+    """
+    Total size of the files under a directory.
+
+    Parameters
+    ----------
+    path : str
+        The directory to measure.
+
+    Returns
+    -------
+    int
+        The size in bytes.
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, filenames in os.walk(path)
+        for filename in filenames
+    )
+
+
+def _run_training(
+    model_name: str, lora_args: dict | None, max_steps: int, batch_size: int, max_length: int
+) -> dict:
+    """
+    Train for a fixed number of steps on random tokens and measure the cost. Meant to be run in its own
+    process so that the peak memory belongs to this run alone.
+    """
+    # Only needed here, so that the parser benchmark doesn't have to load them
+    import torch
+    from transformers import AutoModelForCausalLM, Trainer, TrainerCallback, TrainingArguments
+
+    from echolalia.modeling import apply_lora
+    from echolalia.data import ConversationDataset
+
+    class StepTimer(TrainerCallback):
+        """
+        Trainer callback that records the wall time of each optimizer step.
+        """
+
+        def __init__(self):
+            self.step_times = []
+            self._start = None
+
+        def on_step_begin(self, args, state, control, **kwargs):
+            self._start = time.perf_counter()
+
+        def on_step_end(self, args, state, control, **kwargs):
+            self.step_times.append(time.perf_counter() - self._start)
+
+    torch.manual_seed(0)
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    if lora_args is not None:
+        model = apply_lora(model, lora_args)
+
+    # The content doesn't matter for timing, only the shape
+    num_examples = batch_size * max_steps
+    ids = torch.randint(0, model.config.vocab_size, (num_examples, max_length))
+    dataset = ConversationDataset(ids, ids)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        timer = StepTimer()
+        trainer = Trainer(
+            model=model,
+            args=TrainingArguments(
+                output_dir=output_dir,
+                max_steps=max_steps,
+                per_device_train_batch_size=batch_size,
+                save_strategy="no",
+                report_to="none",
+                use_cpu=True,
+            ),
+            train_dataset=dataset,
+            callbacks=[timer],
+        )
+        trainer.train()
+
+        model_dir = os.path.join(output_dir, "model")
+        trainer.save_model(model_dir)
+        artifact_bytes = directory_size(model_dir)
+
+    # Skip the first step, which includes one-off allocation and warm-up
+    step_times = timer.step_times[1:] or timer.step_times
+
+    return {
+        "mode": "full" if lora_args is None else "lora",
+        "trainable_params": sum(p.numel() for p in model.parameters() if p.requires_grad),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on Linux
+        "step_time_s": sum(step_times) / len(step_times),
+        "artifact_mb": artifact_bytes / 1024**2,
+    }
+
+
+def benchmark_training(
+    model_name: str = "distilgpt2",
+    lora_args: dict | None = None,
+    max_steps: int = 10,
+    batch_size: int = 2,
+    max_length: int = 128,
+) -> pd.DataFrame:
+    """
+    Compare full fine-tuning with LoRA adapter training on CPU: peak memory, mean step time and saved artifact
+    size.
+
+    Parameters
+    ----------
+    model_name : str, optional
+        The model to train, by default "distilgpt2"
+    lora_args : dict, optional
+        Overrides for the LoRA defaults, by default None
+    max_steps : int, optional
+        The number of optimizer steps per run, by default 10
+    batch_size : int, optional
+        The batch size, by default 2
+    max_length : int, optional
+        The sequence length of each example, by default 128
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per training mode.
+    """
+    # A fresh process per mode, otherwise the peak memory of the first run hides the second
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        results = [
+            pool.apply(_run_training, (model_name, args, max_steps, batch_size, max_length))
+            for args in (None, lora_args or {})
+        ]
+
+    return pd.DataFrame(results).set_index("mode")
+
+
+def synthetic_imessage_log(num_messages: int, max_lines: int = 4, seed: int = 0) -> str:
+    """
+    Generate a chat log in the imessage-exporter text format.
+
+    Parameters
+    ----------
+    num_messages : int
+        The number of messages.
+    max_lines : int, optional
+        The maximum number of lines of text per message, by default 4
+    seed : int, optional
+        The random seed, by default 0
+
+    Returns
+    -------
+    str
+        The chat log text.
+    """
+    rng = random.Random(seed)
+    lines = []
+
+    for _ in range(num_messages):
+        lines.append(
+            f"{rng.choice(['Jan', 'Jun', 'Dec'])} {rng.randint(1, 28):02d}, 2023 {rng.randint(1, 12):2d}:"
+            f"{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} {rng.choice(['AM', 'PM'])}"
+            f"{rng.choice(['', ' (Read by you after 1 minute)'])}"
+        )
+        lines.append(rng.choice(["Me", "+14155550123"]))
+        num_lines = rng.randint(1, max_lines)
+        lines.extend(rng.choice(["hello there", "ha", "", "what about tomorrow?"]) for _ in range(num_lines))
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def previous_scan(chat_log: str) -> list[dict]:
+    """
+    The scanning loop of the previous iMessage parser, kept as a reference: each line is searched for a
+    timestamp anywhere in it, and message text is appended to a string in a dict, which copies the whole
+    message for every line.
+
+    Parameters
+    ----------
+    chat_log : str
+        The chat log text.
+
+    Returns
+    -------
+    list[dict]
+        The messages.
+    """
+    timestamp_pattern = re.compile(r"[A-Za-z]{3} \d{1,2}, \d{4} \s*\d{1,2}:\d{2}:\d{2} (AM|PM)")
+    sanitize = iMessageParser()._sanitize_message
+
+    messages = []
+    payload = None
+    lines = iter(chat_log.splitlines())
+    for line in lines:
+        match = re.search(timestamp_pattern, line)
+        if match:
+            if payload:
+                payload["message"] = sanitize(payload["message"].strip())
+                if payload["message"]:
+                    messages.append(payload)
+
+            payload = {"timestamp": None, "user": None, "message": "", "exception": None}
+            payload["timestamp"] = datetime.strptime(match.group(0), "%b %d, %Y %I:%M:%S %p")
+            payload["user"] = next(lines).strip()
+        else:
+            payload["message"] += " " + line
+
+    payload["message"] = payload["message"].strip()
+    messages.append(payload)
+
+    return messages
+
+
+def benchmark_parser(
+    num_messages: int = 100_000, paste_lines: int = 50_000, repeat: int = 3
+) -> pd.DataFrame:
+    """
+    Measure the throughput of the iMessage scanner on a typical log, and on a single long pasted message at
+    two lengths, against the previous parser's loop. The previous loop slows down with the length of the
+    message, the scanner doesn't.
+
+    Parameters
+    ----------
+    num_messages : int, optional
+        The number of messages in the typical log, by default 100_000
+    paste_lines : int, optional
+        The number of lines in the shorter pasted message, by default 50_000
+    repeat : int, optional
+        The number of timed runs of the scanner, of which the fastest is reported, by default 3. The previous
+        loop is timed once, as it takes far longer
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per log and parser.
+    """
+    logs = {"typical": synthetic_imessage_log(num_messages)}
+    for multiple in (1, 2):
+        paste = "\n".join(["a long pasted line of text"] * (paste_lines * multiple))
+        logs[f"long paste x{multiple}"] = f"Jan 01, 2023 12:00:00 PM\nMe\n{paste}"
+
+    scanners = {"scan_chat_log": (iMessageParser().scan_chat_log, repeat), "previous": (previous_scan, 1)}
+
+    results = []
+    for name, chat_log in logs.items():
+        num_lines = chat_log.count("\n") + 1
+        for parser, (scan, runs) in scanners.items():
+            seconds = min(_timed(scan, chat_log) for _ in range(runs))
+            results.append(
+                {
+                    "log": name,
+                    "parser": parser,
+                    "lines": num_lines,
+                    "seconds": seconds,
+                    "lines_per_s": num_lines / seconds,
+                }
+            )
+
+    return pd.DataFrame(results).set_index(["log", "parser"])
+
+
+def _timed(fn, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    # Full fine-tuning vs. LoRA
+    training = subparsers.add_parser("training", help="compare full fine-tuning with LoRA")
+    training.add_argument("--model-name", type=str, default="distilgpt2", help="model to train")
+    training.add_argument("--max-steps", type=int, default=10, help="optimizer steps per run")
+    training.add_argument("--batch-size", type=int, default=2, help="batch size")
+    training.add_argument("--max-length", type=int, default=128, help="tokens per example")
+
+    # iMessage parsing throughput
+    parsing = subparsers.add_parser("parser", help="iMessage parsing throughput")
+    parsing.add_argument("--num-messages", type=int, default=100_000, help="messages in the typical log")
+    parsing.add_argument("--paste-lines", type=int, default=50_000, help="lines in the shorter long paste")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.benchmark == "training":
+        print(
+            benchmark_training(
+                model_name=args.model_name,
+                max_steps=args.max_steps,
+                batch_size=args.batch_size,
+                max_length=args.max_length,
+            ).to_string()
+        )
+    elif args.benchmark == "parser":
+        print(benchmark_parser(num_messages=args.num_messages, paste_lines=args.paste_lines).to_string())
@@ -0,0 +1,457 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import boto3
+import torch
+import yaml
+from transformers import TrainerCallback
+
+from ._utils import get_matching_s3_objects
+
+# Written last when uploading a checkpoint. A checkpoint without it is incomplete and is never resumed
+# from
+COMPLETE_MARKER = ".complete"
+
+# Written last when a training run finishes. A restarted job with the same manifest then trains again from
+# scratch rather than resuming from the end
+FINISHED_MARKER = ".finished"
+
+# Written into each checkpoint, naming the run (see `CheckpointManager.run_name`) it belongs to
+RUN_FILE = "echolalia_run.txt"
+
+CHECKPOINT_PATTERN = re.compile(r"checkpoint-(\d+)$")
+
+
+class S3Store(object):
+    """
+    Checkpoint storage in an S3 bucket.
+    """
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+        self.s3 = boto3.client("s3")
+
+    def list_keys(self, prefix: str) -> list[str]:
+        return [obj["Key"] for obj in get_matching_s3_objects(bucket=self.bucket, prefix=prefix)]
+
+    def upload_file(self, path: str, key: str):
+        self.s3.upload_file(Filename=path, Bucket=self.bucket, Key=key)
+
+    def download_file(self, key: str, path: str):
+        self.s3.download_file(Bucket=self.bucket, Key=key, Filename=path)
+
+    def delete_prefix(self, prefix: str):
+        for key in self.list_keys(prefix):
+            self.s3.delete_object(Bucket=self.bucket, Key=key)
+
+
+class LocalStore(object):
+    """
+    Checkpoint storage in a local directory, a stand-in for S3 when running outside of AWS.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def list_keys(self, prefix: str) -> list[str]:
+        keys = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return keys
+
+    def upload_file(self, path: str, key: str):
+        destination = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(path, destination)
+
+    def download_file(self, key: str, path: str):
+        shutil.copyfile(os.path.join(self.root, key), path)
+
+    def delete_prefix(self, prefix: str):
+        path = os.path.join(self.root, prefix)
+        if os.path.isfile(path):
+            os.remove(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class CheckpointManager(TrainerCallback):
+    """
+    Trainer callback that uploads each checkpoint to S3 (or a local stand-in) in a background thread while
+    training continues, and restores the latest complete checkpoint and the tokenized dataset when a job is
+    restarted.
+
+    Checkpoints are stored as `<prefix>/<run>/checkpoint-<step>/...`, where the run is named after everything
+    in the manifest that affects training, so that a changed manifest never resumes from another run's
+    checkpoints. The tokenized dataset is stored as `<prefix>/dataset-<hash>.pt`, where the hash covers
+    everything in the manifest that affects tokenization.
+    """
+
+    def __init__(
+        self, store: S3Store | LocalStore, prefix: str, keep: int | None = None, run: str | None = None
+    ):
+        self.store = store
+        self.prefix = prefix.rstrip("/")
+        self.keep = keep
+
+        # Without a run name, checkpoints go directly under the prefix and are resumed regardless of origin
+        self.run = run
+        self.checkpoint_prefix = f"{self.prefix}/{run}" if run else self.prefix
+
+        # A single worker keeps uploads in order, so the newest checkpoint is always the last to complete
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-upload")
+        self._uploads: list[Future] = []
+
+        # Time spent with training blocked on checkpoint I/O
+        self._save_started = None
+        self.blocked_seconds = 0.0
+
+    @classmethod
+    def from_manifest(cls, manifest: dict, bucket: str) -> "CheckpointManager":
+        """
+        Create a checkpoint manager from the `checkpoints` section of a training manifest.
+
+        Parameters
+        ----------
+        manifest : dict
+            The training manifest.
+        bucket : str
+            The S3 bucket to upload to, unless `local_dir` is given in the manifest.
+
+        Returns
+        -------
+        CheckpointManager
+            The checkpoint manager.
+        """
+        config = manifest["checkpoints"]
+        store = LocalStore(config["local_dir"]) if config.get("local_dir") else S3Store(bucket)
+
+        keep = manifest["training_args"].get("save_total_limit")
+
+        return cls(store=store, prefix=config["prefix"], keep=keep, run=cls.run_name(manifest))
+
+    @staticmethod
+    def _manifest_hash(manifest: dict, keys: list[str]) -> str:
+        key = yaml.safe_dump({key: manifest.get(key) for key in keys}, sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def run_name(cls, manifest: dict) -> str:
+        """
+        Name the training run after the parts of the manifest that determine its checkpoints.
+        """
+        keys = ["sources", "model_name", "lora", "holdout", "training_args"]
+        return f"run-{cls._manifest_hash(manifest, keys)}"
+
+    # Tokenized dataset cache
+
+    @classmethod
+    def dataset_name(cls, manifest: dict) -> str:
+        """
+        Name the tokenized dataset after the parts of the manifest that determine it.
+        """
+        return f"dataset-{cls._manifest_hash(manifest, ['sources', 'model_name', 'holdout'])}.pt"
+
+    def load_dataset(self, manifest: dict, local_dir: str) -> dict | None:
+        """
+        Fetch the cached tokenized dataset for this manifest, if one was stored by a previous run.
+
+        Parameters
+        ----------
+        manifest : dict
+            The training manifest.
+        local_dir : str
+            The directory to download the dataset to.
+
+        Returns
+        -------
+        dict | None
+            The cached tensors (as saved by `save_dataset`), or None if there is no usable cache.
+        """
+        name = self.dataset_name(manifest)
+        path = os.path.join(local_dir, name)
+
+        try:
+            if not os.path.isfile(path):
+                key = f"{self.prefix}/{name}"
+                if key not in self.store.list_keys(key):
+                    return None
+                os.makedirs(local_dir, exist_ok=True)
+                self.store.download_file(key, f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+
+            tensors = torch.load(path, weights_only=True)
+        except Exception as e:
+            # A damaged cache costs a re-tokenization, never the run
+            logging.warning(f"Ignoring unreadable cached dataset {name}: {e}")
+            return None
+
+        logging.info(f"Using cached tokenized dataset {name}")
+        return tensors
+
+    def save_dataset(self, manifest: dict, local_dir: str, tensors: dict):
+        """
+        Store the tokenized dataset so that a restarted job can skip parsing and tokenizing. The upload runs
+        in the background.
+
+        Parameters
+        ----------
+        manifest : dict
+            The training manifest.
+        local_dir : str
+            The directory to write the dataset to.
+        tensors : dict
+            The tensors to save.
+        """
+        name = self.dataset_name(manifest)
+        path = os.path.join(local_dir, name)
+
+        # Write to a temporary file first, so that a job killed mid-write can't leave a truncated cache behind
+        os.makedirs(local_dir, exist_ok=True)
+        torch.save(tensors, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+        self._submit(self.store.upload_file, path, f"{self.prefix}/{name}")
+
+    # Checkpoints
+
+    def _stored_checkpoints(self) -> dict[int, list[str]]:
+        """
+        Find all checkpoints in the store, complete or not, keyed by step.
+        """
+        checkpoints = {}
+        for key in self.store.list_keys(f"{self.checkpoint_prefix}/checkpoint-"):
+            directory, _, filename = key[len(self.checkpoint_prefix) + 1 :].partition("/")
+            match = CHECKPOINT_PATTERN.match(directory)
+            if match and filename:
+                checkpoints.setdefault(int(match.group(1)), []).append(key)
+
+        return checkpoints
+
+    def _remote_checkpoints(self) -> dict[int, list[str]]:
+        """
+        Find the complete checkpoints in the store, keyed by step.
+        """
+        return {
+            step: keys
+            for step, keys in self._stored_checkpoints().items()
+            if any(key.endswith(f"/{COMPLETE_MARKER}") for key in keys)
+        }
+
+    def _is_own(self, checkpoint_dir: str) -> bool:
+        """
+        Check whether a local checkpoint was written by this run.
+        """
+        if not self.run:
+            return True
+
+        run_file = os.path.join(checkpoint_dir, RUN_FILE)
+        if not os.path.isfile(run_file):
+            return False
+
+        with open(run_file) as f:
+            return f.read().strip() == self.run
+
+    def _local_checkpoints(self, output_dir: str) -> dict[int, str]:
+        """
+        Find the checkpoints this run has written locally, keyed by step. The trainer state is written last,
+        so a checkpoint without it was interrupted.
+        """
+        checkpoints = {}
+        if os.path.isdir(output_dir):
+            for directory in os.listdir(output_dir):
+                match = CHECKPOINT_PATTERN.match(directory)
+                path = os.path.join(output_dir, directory)
+                if match and os.path.isfile(os.path.join(path, "trainer_state.json")) and self._is_own(path):
+                    checkpoints[int(match.group(1))] = path
+        return checkpoints
+
+    def _clear_finished(self, output_dir: str):
+        """
+        Delete the checkpoints of a finished run, so that running it again starts from scratch.
+        """
+        logging.info(f"Run {self.run} already finished, training again from scratch")
+
+        for path in self._local_checkpoints(output_dir).values():
+            shutil.rmtree(path)
+        for step in self._stored_checkpoints():
+            self.store.delete_prefix(f"{self.checkpoint_prefix}/checkpoint-{step}/")
+        self.store.delete_prefix(f"{self.checkpoint_prefix}/{FINISHED_MARKER}")
+
+    def restore_latest(self, output_dir: str) -> str | None:
+        """
+        Find the latest complete checkpoint, locally or in the store, downloading it if need be.
+
+        Parameters
+        ----------
+        output_dir : str
+            The Trainer output directory.
+
+        Returns
+        -------
+        str | None
+            The local path of the checkpoint to resume from, or None to start from scratch.
+        """
+        # Running a finished run again means training it again
+        finished = f"{self.checkpoint_prefix}/{FINISHED_MARKER}"
+        if finished in self.store.list_keys(finished):
+            self._clear_finished(output_dir)
+            return None
+
+        local = self._local_checkpoints(output_dir)
+        remote = self._remote_checkpoints()
+
+        latest_local = max(local, default=-1)
+        latest_remote = max(remote, default=-1)
+
+        if latest_local < 0 and latest_remote < 0:
+            return None
+
+        if latest_local >= latest_remote:
+            logging.info(f"Resuming from local checkpoint at step {latest_local}")
+            return local[latest_local]
+
+        # Download the remote checkpoint into the output directory, where the Trainer expects it, replacing
+        # anything from another run already there
+        path = os.path.join(output_dir, f"checkpoint-{latest_remote}")
+        shutil.rmtree(path, ignore_errors=True)
+        for key in remote[latest_remote]:
+            if key.endswith(f"/{COMPLETE_MARKER}"):
+                continue
+            relative_key = key[len(f"{self.checkpoint_prefix}/checkpoint-{latest_remote}/") :]
+            destination = os.path.join(path, relative_key)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            self.store.download_file(key, destination)
+
+        logging.info(f"Resuming from remote checkpoint at step {latest_remote}")
+        return path
+
+    def _upload_checkpoint(self, staging_dir: str, name: str):
+        """
+        Upload a staged checkpoint, mark it complete and prune old ones. Runs in the background thread.
+        """
+        try:
+            prefix = f"{self.checkpoint_prefix}/{name}"
+            for dirpath, _, filenames in os.walk(staging_dir):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    key = os.path.relpath(path, staging_dir).replace(os.sep, "/")
+                    self.store.upload_file(path, f"{prefix}/{key}")
+
+            # Only now is the checkpoint safe to resume from
+            marker = os.path.join(staging_dir, COMPLETE_MARKER)
+            open(marker, "w").close()
+            self.store.upload_file(marker, f"{prefix}/{COMPLETE_MARKER}")
+
+            self._prune()
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _prune(self):
+        """
+        Delete complete checkpoints beyond the Trainer's save_total_limit, and the remains of failed uploads
+        older than the newest complete checkpoint.
+        """
+        stored = self._stored_checkpoints()
+        complete = sorted(self._remote_checkpoints())
+
+        stale = complete[: -self.keep] if self.keep else []
+        stale += [step for step in stored if step not in complete and complete and step < complete[-1]]
+
+        for step in stale:
+            self.store.delete_prefix(f"{self.checkpoint_prefix}/checkpoint-{step}/")
+
+    def _finish(self, output_dir: str):
+        """
+        Mark the run finished in the store. Runs in the background thread, after the last upload.
+        """
+        marker = os.path.join(output_dir, FINISHED_MARKER)
+        open(marker, "w").close()
+        self.store.upload_file(marker, f"{self.checkpoint_prefix}/{FINISHED_MARKER}")
+        os.remove(marker)
+
+    @staticmethod
+    def _log_failure(future: Future):
+        # A failed upload shouldn't stop training, the next checkpoint will be uploaded regardless
+        if future.exception():
+            logging.error(f"Error uploading checkpoint: {future.exception()}")
+
+    def _submit(self, fn, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._log_failure)
+        self._uploads.append(future)
+
+    # Trainer callbacks. The Trainer calls these, in order, on each step: on_step_end, then at the end of an
+    # epoch on_epoch_end, then on_log, on_evaluate, writes the checkpoint and calls on_save. A save is due
+    # from on_step_end for step-based saving, and from on_epoch_end for epoch-based saving. The blocked time
+    # runs from the last of these to on_save
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self._save_started = time.perf_counter() if control.should_save else None
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        if control.should_save:
+            self._save_started = time.perf_counter()
+
+    def on_log(self, args, state, control, **kwargs):
+        if self._save_started is not None:
+            self._save_started = time.perf_counter()
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        if self._save_started is not None:
+            self._save_started = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        name = f"checkpoint-{state.global_step}"
+        checkpoint_dir = os.path.join(args.output_dir, name)
+        staging_dir = os.path.join(args.output_dir, f".upload-{name}")
+
+        # Tie the checkpoint to this run, so a run with a different manifest doesn't resume from it
+        if self.run:
+            with open(os.path.join(checkpoint_dir, RUN_FILE), "w") as f:
+                f.write(self.run)
+
+        # Hard link the files into a staging directory so the upload is unaffected by the Trainer rotating
+        # its checkpoints. This is near-instant, unlike copying
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        try:
+            shutil.copytree(checkpoint_dir, staging_dir, copy_function=os.link)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            shutil.copytree(checkpoint_dir, staging_dir)
+
+        self._submit(self._upload_checkpoint, staging_dir, name)
+
+        if self._save_started is not None:
+            self.blocked_seconds += time.perf_counter() - self._save_started
+            self._save_started = None
+
+    def on_train_end(self, args, state, control, **kwargs):
+        # Training is over, but the last uploads still have to finish before the job exits
+        started = time.perf_counter()
+        if self.run:
+            self._submit(self._finish, args.output_dir)
+        self.wait()
+        waited = time.perf_counter() - started
+
+        logging.info(
+            f"Training was blocked on checkpoint I/O for {self.blocked_seconds:.1f}s, "
+            f"then waited {waited:.1f}s for the final uploads"
+        )
+        self.blocked_seconds += waited
+
+    def wait(self):
+        """
+        Block until all pending uploads have finished.
+        """
+        for future in self._uploads:
+            future.exception()
+        self._uploads = []
@@ -0,0 +1,104 @@
+import pandas as pd
+from torch.utils.data import Dataset
+
+from echolalia.constants import S3_BUCKET_NAME
+from echolalia.parser import WhatsAppParser, iMessageParser
+
+
+class ConversationDataset(Dataset):
+    """
+    The ConversationDataset class is a PyTorch Dataset that takes in a list of input_ids and output_ids. It 
+    wraps a tokenized data into a format compatible with PyTorch, which requires a dataset to be a subclass 
+    of torch.utils.data.Dataset
+    """
+
+    def __init__(self, input_ids, output_ids):
+        self.input_ids = input_ids
+        self.output_ids = output_ids
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, idx):
+        return {
+            "input_ids": self.input_ids[idx],
+            "labels": self.output_ids[idx]  # Model needs labels during training
+        }
+
+
+def build_training_data(manifest: dict) -> pd.DataFrame:
+    """
+    Parse each of the manifest's sources and pair every message to the target user with the target user's
+    reply.
+
+    Parameters
+    ----------
+    manifest : dict
+        The training manifest.
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with an "input" and an "output" column.
+    """
+    source_data = []
+
+    # Gather messages for each source
+    for source in manifest["sources"]:
+        # Check for source type
+        if source["type"] == "WhatsApp":
+            parser = WhatsAppParser()
+        elif source["type"] == "iMessage":
+            parser = iMessageParser()
+        else:
+            raise ValueError(f"Unknown source type: {source['type']}")
+        
+        # Parse chat log
+        messages = parser.parse_chat_log(bucket=S3_BUCKET_NAME, chat_log_filename=source["logfile"])
+    
+        # Prune messages
+        # If the first message is from the target user, it won't be correlated to a previous input, so remove
+        # it
+        if messages.iloc[0]["user"] == source["user"]:
+            messages = messages.iloc[1:]
+        # If the last message is NOT from the target user, it won't be correlated to a following output, so
+        # remove it
+        if messages.iloc[-1]["user"] != source["user"]:
+            messages = messages.iloc[:-1]
+
+        # Now inputs and outputs are aligned, one row after the other. Join into a single DataFrame
+        source_data.append(pd.DataFrame({
+            "input": messages[messages["user"] != source["user"]]["message"].values,
+            "output": messages[messages["user"] == source["user"]]["message"].values,
+            "timestamp": messages[messages["user"] == source["user"]]["timestamp"].map(min).values  # Replies
+        }))
+
+    # Combine all sources into a single DataFrame
+    return pd.concat(source_data, ignore_index=True)
+
+
+def split_holdout(training_data: pd.DataFrame, holdout: int | None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split off the most recent exchanges, across all sources, for evaluation.
+
+    Parameters
+    ----------
+    training_data : pd.DataFrame
+        The exchanges, as returned by `build_training_data`.
+    holdout : int | None
+        The number of exchanges to hold out, or None to hold out nothing.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        The exchanges to train on and the held-out exchanges, each in time order.
+    """
+    holdout = holdout or 0
+    if not 0 <= holdout < len(training_data):
+        raise ValueError(f"holdout must be at least 0 and less than the {len(training_data)} exchanges")
+
+    training_data = training_data.sort_values(by="timestamp", kind="stable")
+
+    split = len(training_data) - holdout
+
+    return training_data.iloc[:split].copy(), training_data.iloc[split:].copy()
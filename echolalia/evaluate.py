@@ -0,0 +1,338 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import torch
+import yaml
+
+from echolalia._utils import read_s3_file
+from echolalia.constants import S3_BUCKET_NAME
+from echolalia.modeling import load_model
+from echolalia.data import build_training_data, split_holdout
+
+
+def load_manifest(manifest: str) -> dict:
+    """
+    Load a training manifest from a local file or, failing that, from S3.
+
+    Parameters
+    ----------
+    manifest : str
+        The local path or S3 key of the manifest.
+
+    Returns
+    -------
+    dict
+        The training manifest.
+    """
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            return yaml.safe_load(f)
+
+    return yaml.safe_load(read_s3_file(S3_BUCKET_NAME, manifest))
+
+
+def load_prompts(manifest: dict) -> pd.DataFrame:
+    """
+    Assemble the prompt set: the most recent exchanges, which training holds out, with the target user's
+    actual replies as references, plus the manifest's probes (inside jokes and the like) with the words a good
+    reply should contain.
+
+    Parameters
+    ----------
+    manifest : dict
+        The training manifest.
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with "kind", "prompt", "reference" and "expect" columns.
+    """
+    prompts = []
+
+    # The most recent exchanges, which training leaves out
+    if manifest.get("holdout"):
+        _, held_out = split_holdout(build_training_data(manifest), manifest["holdout"])
+        prompts.append(
+            pd.DataFrame(
+                {
+                    "kind": "holdout",
+                    "prompt": held_out["input"].values,
+                    "reference": held_out["output"].values,
+                    "expect": None,
+                }
+            )
+        )
+
+    if manifest.get("probes"):
+        prompts.append(
+            pd.DataFrame(
+                {
+                    "kind": "probe",
+                    "prompt": [probe["prompt"] for probe in manifest["probes"]],
+                    "reference": None,
+                    "expect": [probe.get("expect", []) for probe in manifest["probes"]],
+                }
+            )
+        )
+
+    if not prompts:
+        raise ValueError("The manifest has neither a holdout nor any probes to evaluate")
+
+    return pd.concat(prompts, ignore_index=True)
+
+
+def unigram_f1(response: str, reference: str) -> float:
+    """
+    Word overlap between a response and a reference, as the F1 of the shared (lower-cased) words.
+
+    Parameters
+    ----------
+    response : str
+        The generated response.
+    reference : str
+        The reference reply.
+
+    Returns
+    -------
+    float
+        The F1 score, between 0 and 1.
+    """
+    response_words = Counter(response.lower().split())
+    reference_words = Counter(reference.lower().split())
+    shared = sum((response_words & reference_words).values())
+
+    if not shared:
+        return 0.0
+
+    precision = shared / sum(response_words.values())
+    recall = shared / sum(reference_words.values())
+
+    return 2 * precision * recall / (precision + recall)
+
+
+def distinct_n(responses: list[str], n: int = 2) -> float:
+    """
+    The fraction of n-grams across all responses that are unique. Low values mean repetitive responses.
+
+    Parameters
+    ----------
+    responses : list[str]
+        The generated responses.
+    n : int, optional
+        The n-gram size, by default 2
+
+    Returns
+    -------
+    float
+        The fraction of distinct n-grams, between 0 and 1.
+    """
+    ngrams = []
+    for response in responses:
+        words = response.lower().split()
+        ngrams.extend(zip(*(words[i:] for i in range(n)), strict=False))
+
+    return len(set(ngrams)) / len(ngrams) if ngrams else 0.0
+
+
+def generate(model, tokenizer, prompts: list[str], batch_size: int, generation_args: dict) -> pd.DataFrame:
+    """
+    Generate a response to each prompt, in batches.
+
+    Parameters
+    ----------
+    model : AutoModelForCausalLM
+        The model.
+    tokenizer : AutoTokenizer
+        The model's tokenizer.
+    prompts : list[str]
+        The prompts.
+    batch_size : int
+        The number of prompts per batch.
+    generation_args : dict
+        Arguments to `model.generate`, e.g. max_new_tokens.
+
+    Returns
+    -------
+    pd.DataFrame
+        The response, number of generated tokens and batch latency for each prompt.
+    """
+    # Decoder-only models continue from the end of the prompt, so pad and truncate on the left
+    tokenizer.padding_side = "left"
+    tokenizer.truncation_side = "left"
+
+    results = []
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start : start + batch_size]
+        inputs = tokenizer(batch, return_tensors="pt", padding=True, truncation=True, max_length=512)
+
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = model.generate(**inputs, pad_token_id=tokenizer.pad_token_id, **generation_args)
+        latency = time.perf_counter() - started
+
+        # Keep only the new tokens, and stop counting at the first end of sequence
+        new_tokens = outputs[:, inputs["input_ids"].shape[1] :]
+        for tokens in new_tokens:
+            eos = (tokens == tokenizer.eos_token_id).nonzero()
+            num_tokens = int(eos[0]) if len(eos) else len(tokens)
+            results.append(
+                {
+                    "response": tokenizer.decode(tokens[:num_tokens], skip_special_tokens=True).strip(),
+                    "new_tokens": num_tokens,
+                    "latency_s": latency,
+                }
+            )
+
+    return pd.DataFrame(results)
+
+
+def _evaluate_model(
+    model_dir: str, prompts: pd.DataFrame, batch_size: int, generation_args: dict, seed: int
+) -> tuple:
+    """
+    Load one model and run the prompt set through it. Meant to be run in its own process so that the peak
+    memory belongs to this model alone.
+    """
+    torch.manual_seed(seed)
+
+    started = time.perf_counter()
+    model, tokenizer = load_model(model_dir)
+    load_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    responses = generate(model, tokenizer, prompts["prompt"].tolist(), batch_size, generation_args)
+    total_s = time.perf_counter() - started
+
+    responses = pd.concat([prompts.reset_index(drop=True), responses], axis=1)
+    responses.insert(0, "model_dir", model_dir)
+
+    # Quality: overlap with the real replies, and whether probes hit the expected words
+    holdout = responses[responses["kind"] == "holdout"]
+    holdout_f1 = [
+        unigram_f1(response, reference)
+        for response, reference in zip(holdout["response"], holdout["reference"], strict=True)
+    ]
+
+    probes = responses[responses["kind"] == "probe"]
+    probe_hits = [
+        any(word.lower() in response.lower() for word in expect)
+        for response, expect in zip(probes["response"], probes["expect"], strict=True)
+        if expect
+    ]
+
+    # Each batch is timed once, so take percentiles over batches rather than prompts
+    batch_latencies = responses["latency_s"].iloc[::batch_size]
+
+    summary = {
+        "model_dir": model_dir,
+        "batch_size": batch_size,
+        **generation_args,
+        "prompts": len(responses),
+        "load_s": load_s,
+        "prompts_per_s": len(responses) / total_s,
+        "tokens_per_s": responses["new_tokens"].sum() / total_s,
+        "latency_p50_s": batch_latencies.quantile(0.5),
+        "latency_p90_s": batch_latencies.quantile(0.9),
+        "latency_p99_s": batch_latencies.quantile(0.99),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on Linux
+        "holdout_f1": np.mean(holdout_f1) if holdout_f1 else np.nan,
+        "probe_hit_rate": np.mean(probe_hits) if probe_hits else np.nan,
+        "distinct_2": distinct_n(responses["response"].tolist(), n=2),
+        "empty_rate": (responses["response"] == "").mean(),
+    }
+
+    return summary, responses
+
+
+def evaluate(
+    model_dirs: list[str],
+    prompts: pd.DataFrame,
+    batch_size: int = 8,
+    generation_args: dict | None = None,
+    seed: int = 0,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Run the same prompt set through each model on CPU and measure speed, memory and quality.
+
+    Parameters
+    ----------
+    model_dirs : list[str]
+        The saved models (full models or LoRA adapters) to compare.
+    prompts : pd.DataFrame
+        The prompt set, as returned by `load_prompts`.
+    batch_size : int, optional
+        The number of prompts per batch, by default 8
+    generation_args : dict, optional
+        Arguments to `model.generate`, by default None
+    seed : int, optional
+        The random seed, for sampling, by default 0
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        A summary with one row per model, and every response.
+    """
+    generation_args = generation_args or {}
+
+    # A fresh process per model, otherwise the peak memory of the first model hides the others
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        results = [
+            pool.apply(_evaluate_model, (model_dir, prompts, batch_size, generation_args, seed))
+            for model_dir in model_dirs
+        ]
+
+    summaries, responses = zip(*results, strict=True)
+
+    return pd.DataFrame(summaries), pd.concat(responses, ignore_index=True)
+
+
+def _append_csv(df: pd.DataFrame, path: str):
+    # Runs accumulate in the same file so that they can be compared later
+    df.to_csv(path, mode="a", header=not os.path.isfile(path), index=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--manifest", type=str, required=True, help="training manifest (file or S3 key)")
+    parser.add_argument("--model-dir", type=str, nargs="+", default=["./model"], help="models to compare")
+    parser.add_argument("--batch-size", type=int, default=8, help="prompts per batch")
+    parser.add_argument("--max-new-tokens", type=int, default=40, help="tokens to generate per prompt")
+    parser.add_argument("--do-sample", action="store_true", help="sample rather than decode greedily")
+    parser.add_argument("--temperature", type=float, default=1.0, help="sampling temperature")
+    parser.add_argument("--top-p", type=float, default=1.0, help="nucleus sampling probability")
+    parser.add_argument("--num-beams", type=int, default=1, help="beams for beam search")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output-dir", type=str, default=None, help="directory to append results to")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Always pass every setting, so that each run has the same columns in the results
+    generation_args = {
+        "max_new_tokens": args.max_new_tokens,
+        "do_sample": args.do_sample,
+        "temperature": args.temperature,
+        "top_p": args.top_p,
+        "num_beams": args.num_beams,
+    }
+
+    prompts = load_prompts(load_manifest(args.manifest))
+    summary, responses = evaluate(args.model_dir, prompts, args.batch_size, generation_args, args.seed)
+
+    print(summary.T.to_string())
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        _append_csv(summary, os.path.join(args.output_dir, "summary.csv"))
+        _append_csv(responses, os.path.join(args.output_dir, "responses.csv"))
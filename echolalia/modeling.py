@@ -0,0 +1,163 @@
+import os
+import re
+
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+# Default LoRA settings, overridden by the `lora` section of the training manifest
+LORA_DEFAULTS = {
+    "r": 8,  # Rank of the update matrices
+    "lora_alpha": 16,  # Scaling factor
+    "lora_dropout": 0.05,  # Dropout on the adapter inputs
+    "bias": "none",  # Keep the base model biases frozen
+    "task_type": "CAUSAL_LM",
+}
+
+# The name of the file PEFT writes alongside adapter weights
+ADAPTER_CONFIG_NAME = "adapter_config.json"
+
+# The name of the file transformers writes alongside a saved tokenizer
+TOKENIZER_CONFIG_NAME = "tokenizer_config.json"
+
+# Base models already in memory, keyed by model name. Adapters are attached to these rather than re-loading
+# the full set of weights for every persona
+_base_models = {}
+
+# The directory each loaded adapter came from, keyed by adapter name
+_adapter_dirs = {}
+
+
+def apply_lora(model: AutoModelForCausalLM, lora_args: dict | None = None) -> AutoModelForCausalLM:
+    """
+    Wrap a model with low-rank adapters so that only the adapter weights are trained. The base weights are
+    frozen, which removes their gradients and optimizer state from training memory, and `save_pretrained`
+    writes only the adapter weights.
+
+    Parameters
+    ----------
+    model : AutoModelForCausalLM
+        The base model to wrap.
+    lora_args : dict, optional
+        Overrides for `LORA_DEFAULTS`, as given in the `lora` section of the manifest, by default None
+
+    Returns
+    -------
+    AutoModelForCausalLM
+        The wrapped (PEFT) model.
+    """
+    # Only needed when training adapters, so keep it out of the import path for full fine-tuning
+    from peft import LoraConfig, get_peft_model
+
+    lora_config = LoraConfig(**{**LORA_DEFAULTS, **(lora_args or {})})
+
+    return get_peft_model(model, lora_config)
+
+
+def is_adapter(model_dir: str) -> bool:
+    """
+    Check whether a saved model directory contains adapter weights rather than a full model.
+
+    Parameters
+    ----------
+    model_dir : str
+        The directory the model was saved to.
+
+    Returns
+    -------
+    bool
+        True if the directory holds a PEFT adapter.
+    """
+    return os.path.isfile(os.path.join(model_dir, ADAPTER_CONFIG_NAME))
+
+
+def load_base_model(model_name: str) -> AutoModelForCausalLM:
+    """
+    Load a base model, re-using the copy already in memory if there is one.
+
+    Parameters
+    ----------
+    model_name : str
+        The Hugging Face name (or local path) of the base model.
+
+    Returns
+    -------
+    AutoModelForCausalLM
+        The base model.
+    """
+    if model_name not in _base_models:
+        _base_models[model_name] = AutoModelForCausalLM.from_pretrained(model_name)
+
+    return _base_models[model_name]
+
+
+def adapter_name_for(model_dir: str) -> str:
+    """
+    Name an adapter after the directory it was loaded from, so that each directory gets its own adapter.
+
+    Parameters
+    ----------
+    model_dir : str
+        The directory the adapter was saved to.
+
+    Returns
+    -------
+    str
+        The adapter name, with anything that isn't allowed in a module name replaced.
+    """
+    return re.sub(r"\W", "_", os.path.abspath(model_dir)).strip("_")
+
+
+def load_model(model_dir: str, adapter_name: str | None = None) -> tuple[AutoModelForCausalLM, AutoTokenizer]:
+    """
+    Load a trained model for inference. Full models are loaded directly. Adapters are attached to a shared
+    base model, so serving several personas costs one base model plus one small adapter each.
+
+    For adapters, the returned model is that shared base model, with this adapter made active. Loading another
+    adapter onto the same base switches the active adapter for every holder of the model, so call `load_model`
+    again (which is cheap once loaded) before generating for a given persona. Switching is not thread-safe.
+
+    Parameters
+    ----------
+    model_dir : str
+        The directory the model (or adapter) was saved to.
+    adapter_name : str, optional
+        The name to register the adapter under, e.g. the persona, by default named after `model_dir`
+
+    Returns
+    -------
+    tuple[AutoModelForCausalLM, AutoTokenizer]
+        The model, with the requested adapter active, and its tokenizer.
+    """
+    if not is_adapter(model_dir):
+        model = AutoModelForCausalLM.from_pretrained(model_dir)
+        tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    else:
+        from peft import PeftConfig, PeftModel
+
+        adapter_name = adapter_name or adapter_name_for(model_dir)
+        if _adapter_dirs.get(adapter_name, os.path.abspath(model_dir)) != os.path.abspath(model_dir):
+            raise ValueError(f"Adapter name {adapter_name} is already used by {_adapter_dirs[adapter_name]}")
+
+        base_model_name = PeftConfig.from_pretrained(model_dir).base_model_name_or_path
+        model = load_base_model(base_model_name)
+
+        # The first adapter wraps the base model, later ones are added to the same wrapper
+        if isinstance(model, PeftModel):
+            if adapter_name not in model.peft_config:
+                model.load_adapter(model_dir, adapter_name=adapter_name)
+            model.set_adapter(adapter_name)
+        else:
+            model = PeftModel.from_pretrained(model, model_dir, adapter_name=adapter_name)
+            _base_models[base_model_name] = model
+
+        # Only claim the name once the adapter has loaded, so a failed load can be retried
+        _adapter_dirs[adapter_name] = os.path.abspath(model_dir)
+
+        # Training saves the tokenizer alongside the adapter, fall back to the base model's for older adapters
+        has_tokenizer = os.path.isfile(os.path.join(model_dir, TOKENIZER_CONFIG_NAME))
+        tokenizer = AutoTokenizer.from_pretrained(model_dir if has_tokenizer else base_model_name)
+
+    # Match the padding used during training
+    tokenizer.pad_token = tokenizer.eos_token
+    model.eval()
+
+    return model, tokenizer
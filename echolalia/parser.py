@@ -1,5 +1,6 @@
 import re
 from datetime import datetime
+from functools import cache
 from io import BytesIO
 
 import boto3
@@ -243,8 +244,57 @@ class iMessageParser(GenericParser):
     def __init__(self):
         self.messages = []
 
-        # Initialize the timestamp pattern
-        self.timestamp_pattern = re.compile(r"[A-Za-z]{3} \d{1,2}, \d{4} \s*\d{1,2}:\d{2}:\d{2} (AM|PM)")
+        # Initialize the timestamp pattern. Anchored to the start of the line, where imessage-exporter writes
+        # it (indented, for replies in a thread), and split into the date and the time so that each can be
+        # converted separately
+        self.timestamp_pattern = re.compile(
+            r"\s*([A-Za-z]{3} \d{1,2}, \d{4}) \s*(\d{1,2}):(\d{2}):(\d{2}) (AM|PM)"
+        )
+
+        # Attachments show up as a bare filename
+        self.filename_pattern = re.compile(r"^.+\.\w+")
+        self.leading_filename_pattern = re.compile(r"^.+\.\w+\s+")
+
+    @staticmethod
+    @cache
+    def _parse_date(date_str: str) -> datetime:
+        """
+        Convert the date part of a timestamp, e.g. "Jan 02, 2020". Conversations span a limited number of
+        days, so each distinct date is only parsed once.
+
+        Parameters
+        ----------
+        date_str : str
+            The date string.
+
+        Returns
+        -------
+        datetime
+            The date, at midnight.
+        """
+        return datetime.strptime(date_str, "%b %d, %Y")
+
+    def _parse_timestamp(self, match: re.Match) -> datetime:
+        """
+        Convert a timestamp match into a datetime, equivalent to `strptime(..., "%b %d, %Y %I:%M:%S %p")`.
+
+        Parameters
+        ----------
+        match : re.Match
+            The match of `timestamp_pattern`.
+
+        Returns
+        -------
+        datetime
+            The timestamp.
+        """
+        date_str, hour, minute, second, ampm = match.groups()
+        date = self._parse_date(date_str)
+
+        # 12 AM is midnight, 12 PM is noon
+        hour = int(hour) % 12 + (12 if ampm == "PM" else 0)
+
+        return datetime(date.year, date.month, date.day, hour, int(minute), int(second))
 
     def _sanitize_message(self, message: str) -> str:
         """
@@ -260,65 +310,111 @@ class iMessageParser(GenericParser):
         str
             The sanitized message.
         """
-        # Remove filenames (images)
-        base_pattern = r"^.+\.\w+"
-    
-        # Check if the string only contains the filename
-        if re.fullmatch(base_pattern, message):
+        # Check if the string only contains the filename (images)
+        if self.filename_pattern.fullmatch(message):
             message = ""  # If only the filename is present, return an empty string
         else:
             # If there is additional text, remove just the filename
-            message = re.sub(base_pattern + r"\s+", "", message)
+            message = self.leading_filename_pattern.sub("", message)
 
         # Remove out of order / redundant messages
         if "This message responded to an earlier message." in message:
             message = ""
-        
+
         return message
 
-    def parse_chat_log(self, bucket: str, chat_log_filename: str) -> pd.DataFrame:
-        # Download the chat log from S3
-        chat_log = self.download_chat_log(bucket=bucket, chat_log_filename=chat_log_filename)
+    def scan_chat_log(self, chat_log: str) -> pd.DataFrame:
+        """
+        Split the text of a chat log into individual messages in a single pass over its lines.
 
-        # Initialize payload
-        payload = None
+        Each message starts with a timestamp line, followed by the sender and then any number of lines of
+        text. The lines of each message are collected and joined once the message is complete, and the results
+        are gathered column by column.
+
+        Parameters
+        ----------
+        chat_log : str
+            The chat log text.
+
+        Returns
+        -------
+        pd.DataFrame
+            A DataFrame with the timestamp, user, message and exception (always empty) of each non-empty
+            message.
+        """
+        match_timestamp = self.timestamp_pattern.match
+
+        # Output columns
+        timestamps = []
+        users = []
+        messages = []
+
+        # The message currently being read
+        timestamp = user = None
+        parts = []
+
+        def flush():
+            message = self._sanitize_message(" ".join(parts).strip())
+            if message:
+                timestamps.append(timestamp)
+                users.append(user)
+                messages.append(message)
 
-        # For line in chat log, if the timestamp is found, create a new message object based on the remaining content. Keep
-        # track of the current user and timestamp for multi-line messages.
         lines = iter(chat_log.splitlines())
         for line in lines:
-            # Search for the timestamp
-            match = re.search(self.timestamp_pattern, line)
+            match = match_timestamp(line)
 
-            # Extract the timestamp if found and convert to datetime
             if match:  # A new message is starting
                 # Add if there has been a previous line
-                if payload:
-                    payload["message"] = self._sanitize_message(payload["message"].strip())
-                    if payload["message"]:
-                        self.messages.append(payload)
-
-                # Initialize the return payload
-                payload = {"timestamp": None, "user": None, "message": "", "exception": None}
+                if user is not None:
+                    flush()
+
+                timestamp = self._parse_timestamp(match)
+                parts = []
+
+                # Next comes the source. A log cut off right after a timestamp has no source and so no message
+                user = next(lines, None)
+                if user is None:
+                    break
+                user = user.strip()
+            elif user is not None:
+                # We're in a message, add it to the payload
+                parts.append(line)
 
-                # Extract the timestamp string
-                timestamp_str = match.group(0)
+        # The sad, final message
+        if user is not None:
+            flush()
+
+        return pd.DataFrame(
+            {
+                "timestamp": pd.Series(timestamps, dtype="datetime64[ns]"),
+                "user": pd.Series(users, dtype=object),
+                "message": pd.Series(messages, dtype=object),
+                "exception": pd.Series([None] * len(messages), dtype=object),
+            }
+        )
 
-                # Convert the timestamp string to a datetime object
-                payload["timestamp"] = datetime.strptime(timestamp_str, "%b %d, %Y %I:%M:%S %p")
+    def parse_chat_log(self, bucket: str, chat_log_filename: str) -> pd.DataFrame:
+        """
+        Download a chat log from S3 and parse it into a DataFrame of messages, grouped by consecutive sender.
 
-                # Next comes the source
-                payload["user"] = next(lines).strip()
-            else:
-                # We're in a message, add it to the payload
-                payload["message"] += " " + line # Odd way to append, but it works
+        Parameters
+        ----------
+        bucket : str
+            The S3 bucket containing the chat log.
+        chat_log_filename : str
+            The filename of the chat log.
 
-        # The sad, final message
-        payload["message"] = payload["message"].strip()
-        self.messages.append(payload)
+        Returns
+        -------
+        pd.DataFrame
+            A DataFrame containing the parsed chat log.
+        """
+        # Download the chat log from S3
+        chat_log = self.download_chat_log(bucket=bucket, chat_log_filename=chat_log_filename)
 
-        # DataFrame it
-        self.messages = pd.DataFrame(self.messages)
+        # Split into messages
+        self.messages = self.scan_chat_log(chat_log)
 
         # Validate and concatenate the messages
         try:
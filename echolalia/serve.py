@@ -0,0 +1,76 @@
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import torch
+
+from echolalia.modeling import load_model
+
+# SageMaker unpacks the model artifact here and sends requests to this port
+MODEL_DIR = os.environ.get("SM_MODEL_DIR", "/opt/ml/model")
+PORT = int(os.environ.get("SAGEMAKER_BIND_TO_PORT", 8080))
+
+# Generation settings for replies
+GENERATION_ARGS = {
+    "max_new_tokens": 50,
+    "do_sample": True,
+    "top_p": 0.9,
+}
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    Request handler implementing the SageMaker inference container contract: `GET /ping` for health checks and
+    `POST /invocations` with the chat input as the body, answered with the generated reply as plain text.
+    """
+
+    model = None
+    tokenizer = None
+
+    def _respond(self, status: int, body: str = ""):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def do_GET(self):
+        self._respond(200 if self.path == "/ping" else 404)
+
+    def do_POST(self):
+        if self.path != "/invocations":
+            self._respond(404)
+            return
+
+        chat_input = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8").strip()
+
+        try:
+            inputs = self.tokenizer(chat_input, return_tensors="pt", truncation=True, max_length=512)
+            pad_token_id = self.tokenizer.pad_token_id
+            with torch.no_grad():
+                outputs = self.model.generate(**inputs, pad_token_id=pad_token_id, **GENERATION_ARGS)
+
+            # Only the new tokens are the reply
+            reply = outputs[0, inputs["input_ids"].shape[1] :]
+            self._respond(200, self.tokenizer.decode(reply, skip_special_tokens=True).strip())
+        except Exception as e:
+            logging.error(f"Error during generation: {e}")
+            self._respond(500, str(e))
+
+
+def main():
+    # Initialize logging
+    logging.basicConfig(level=logging.INFO)
+
+    # Load the model (or the base model plus adapter) once, before accepting requests
+    InferenceHandler.model, InferenceHandler.tokenizer = load_model(MODEL_DIR)
+
+    # Long inputs keep their end, which is what the reply responds to
+    InferenceHandler.tokenizer.truncation_side = "left"
+    logging.info(f"Loaded model from {MODEL_DIR}, serving on port {PORT}")
+
+    # One request at a time: generation is CPU-bound and the model isn't safe to share between threads
+    HTTPServer(("0.0.0.0", PORT), InferenceHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import argparse
+import logging
 
 import boto3
-import pandas as pd
 import echolalia.run_sagemaker as run_sagemaker
 import torch
 import yaml
@@ -12,33 +12,14 @@ from transformers import (
     Trainer,
     TrainingArguments,
 )
-from torch.utils.data import Dataset
 
+from echolalia.checkpoints import CheckpointManager
 from echolalia.constants import S3_BUCKET_NAME, SAGEMAKER_ARN
-from echolalia.parser import WhatsAppParser, iMessageParser
+from echolalia.data import ConversationDataset, build_training_data, split_holdout
+from echolalia.modeling import apply_lora
 from echolalia._utils import read_s3_file
 
 
-class ConversationDataset(Dataset):
-    """
-    The ConversationDataset class is a PyTorch Dataset that takes in a list of input_ids and output_ids. It 
-    wraps a tokenized data into a format compatible with PyTorch, which requires a dataset to be a subclass 
-    of torch.utils.data.Dataset
-    """
-
-    def __init__(self, input_ids, output_ids):
-        self.input_ids = input_ids
-        self.output_ids = output_ids
-
-    def __len__(self):
-        return len(self.input_ids)
-
-    def __getitem__(self, idx):
-        return {
-            "input_ids": self.input_ids[idx],
-            "labels": self.output_ids[idx]  # Model needs labels during training
-        }
-
 # Define the argument parser
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -49,42 +30,15 @@ def parse_args():
     return parser.parse_args()
 
 if __name__ == "__main__":
+    # Initialize logging
+    logging.basicConfig(level=logging.INFO)
+
     # Parse arguments
     args = parse_args()
 
     # Load manifest from S3
     manifest = yaml.safe_load(read_s3_file(S3_BUCKET_NAME, args.manifest))
 
-    # Gather messages for each source
-    for source in manifest["sources"]:
-        # Check for source type
-        if source["type"] == "WhatsApp":
-            parser = WhatsAppParser()
-        elif source["type"] == "iMessage":
-            parser = iMessageParser()
-        else:
-            raise ValueError(f"Unknown source type: {source['type']}")
-        
-        # Parse chat log
-        messages = parser.parse_chat_log(bucket=S3_BUCKET_NAME, chat_log_filename=source["logfile"])
-    
-        # Prune messages
-        # If the first message is from the target user, it won't be correlated to a previous input, so remove it
-        if messages.iloc[0]["user"] == source["user"]:
-            messages = messages.iloc[1:]
-        # If the last message is NOT from the target user, it won't be correlated to a following output, so remove it
-        if messages.iloc[-1]["user"] != source["user"]:
-            messages = messages.iloc[:-1]
-
-        # Now inputs and outputs are aligned, one row after the other. Join into a single DataFrame
-        source["training_data"] = pd.DataFrame({
-            "input": messages[messages["user"] != source["user"]]["message"].values,
-            "output": messages[messages["user"] == source["user"]]["message"].values
-        })
-    
-    # Combine all sources into a single DataFrame
-    training_data = pd.concat([source["training_data"] for source in manifest["sources"]])
-
     # Model definition
     tokenizer = AutoTokenizer.from_pretrained(manifest["model_name"])
     model = AutoModelForCausalLM.from_pretrained(manifest["model_name"])
@@ -92,17 +46,40 @@ if __name__ == "__main__":
     # Set pad_token to eos_token
     tokenizer.pad_token = tokenizer.eos_token
 
-    # Tokenize the inputs and outputs
-    training_data["input_ids"] = training_data["input"].apply(lambda x: tokenizer.encode(x, truncation=True, padding="max_length", max_length=512))
-    training_data["output_ids"] = training_data["output"].apply(lambda x: tokenizer.encode(x, truncation=True, padding="max_length", max_length=512))
+    # Training args from manifest
+    training_args = TrainingArguments(**manifest["training_args"])
 
-    # Convert columns to lists
-    input_ids = training_data["input_ids"].tolist()
-    output_ids = training_data["output_ids"].tolist()
+    # Upload checkpoints in the background and pick up where a previous run left off, if configured
+    checkpoints = cached = None
+    if manifest.get("checkpoints"):
+        checkpoints = CheckpointManager.from_manifest(manifest, S3_BUCKET_NAME)
+        cached = checkpoints.load_dataset(manifest, training_args.output_dir)
 
-    # Convert lists to PyTorch tensors
-    input_ids_tensor = torch.tensor(input_ids)
-    output_ids_tensor = torch.tensor(output_ids)
+    if cached:
+        input_ids_tensor = cached["input_ids"]
+        output_ids_tensor = cached["output_ids"]
+    else:
+        training_data = build_training_data(manifest)
+
+        # Leave the most recent exchanges out of training, for evaluation
+        training_data, _ = split_holdout(training_data, manifest.get("holdout"))
+
+        # Tokenize the inputs and outputs
+        training_data["input_ids"] = training_data["input"].apply(lambda x: tokenizer.encode(x, truncation=True, padding="max_length", max_length=512))
+        training_data["output_ids"] = training_data["output"].apply(lambda x: tokenizer.encode(x, truncation=True, padding="max_length", max_length=512))
+
+        # Convert columns to lists
+        input_ids = training_data["input_ids"].tolist()
+        output_ids = training_data["output_ids"].tolist()
+
+        # Convert lists to PyTorch tensors
+        input_ids_tensor = torch.tensor(input_ids)
+        output_ids_tensor = torch.tensor(output_ids)
+
+        # Keep the tokenized dataset so a restarted job doesn't have to do all of this again
+        if checkpoints:
+            tensors = {"input_ids": input_ids_tensor, "output_ids": output_ids_tensor}
+            checkpoints.save_dataset(manifest, training_args.output_dir, tensors)
 
     # Ensure both tensors have the same shape for proper input-output pairing
     assert input_ids_tensor.shape == output_ids_tensor.shape
@@ -113,8 +90,10 @@ if __name__ == "__main__":
     # Resize tokens
     model.resize_token_embeddings(len(tokenizer))
 
-    # Training args from manifest
-    training_args = TrainingArguments(**manifest["training_args"])
+    # Train low-rank adapters only, if requested. The saved model is then just the adapter weights
+    if manifest.get("lora"):
+        model = apply_lora(model, manifest["lora"])
+        model.print_trainable_parameters()
 
     # Create the Trainer instance
     trainer = Trainer(
@@ -122,10 +101,13 @@ if __name__ == "__main__":
         args=training_args,     # Training arguments
         train_dataset=dataset,  # Training dataset
         eval_dataset=dataset,   # Same as training dataset for now
+        tokenizer=tokenizer,    # Saved alongside the model for inference
+        callbacks=[checkpoints] if checkpoints else None,
     )
 
-    # Start training
-    trainer.train()
+    # Start training, resuming from the latest complete checkpoint if there is one
+    resume_from_checkpoint = checkpoints.restore_latest(training_args.output_dir) if checkpoints else None
+    trainer.train(resume_from_checkpoint=resume_from_checkpoint)
 
-    # Save the model
+    # Save the model (or only the adapter weights, for LoRA)
     trainer.save_model("./model")
\ No newline at end of file
@@ -0,0 +1,174 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from echolalia.checkpoints import COMPLETE_MARKER, CheckpointManager, LocalStore
+
+PREFIX = "checkpoints/run"
+
+MANIFEST = {"sources": [{"user": "Cat", "logfile": "data/Cat.txt", "type": "WhatsApp"}], "model_name": "gpt2"}
+
+
+def write_checkpoint(output_dir, step, complete=True):
+    """Write a checkpoint the way the Trainer lays it out, with the trainer state last."""
+    path = output_dir / f"checkpoint-{step}"
+    path.mkdir(parents=True)
+    (path / "model.safetensors").write_bytes(b"weights-%d" % step)
+    if complete:
+        (path / "trainer_state.json").write_text("{}")
+
+
+def save(manager, output_dir, step):
+    """Write a checkpoint and hand it to the manager, as the Trainer does on each save."""
+    write_checkpoint(output_dir, step)
+    manager.on_save(SimpleNamespace(output_dir=str(output_dir)), SimpleNamespace(global_step=step), None)
+
+
+def from_manifest(tmp_path, **changes):
+    """A checkpoint manager for a manifest with a local store, as configured in the manifest."""
+    manifest = {
+        **MANIFEST,
+        "checkpoints": {"prefix": PREFIX, "local_dir": str(tmp_path / "store")},
+        "training_args": {"output_dir": "./results", "save_total_limit": 2},
+        **changes,
+    }
+    return CheckpointManager.from_manifest(manifest, bucket="bucket")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStore(str(tmp_path / "store"))
+
+
+def test_upload_prune_and_restore(tmp_path, store):
+    output_dir = tmp_path / "output"
+    manager = CheckpointManager(store, PREFIX, keep=2)
+
+    # The remains of an upload that failed before its marker was written
+    (tmp_path / "partial").write_bytes(b"partial")
+    store.upload_file(str(tmp_path / "partial"), f"{PREFIX}/checkpoint-5/model.safetensors")
+
+    for step in (10, 20, 30):
+        save(manager, output_dir, step)
+    manager.wait()
+
+    # Only the newest `keep` complete checkpoints are left, and the failed upload is gone
+    assert sorted(manager._stored_checkpoints()) == [20, 30]
+    assert f"{PREFIX}/checkpoint-30/{COMPLETE_MARKER}" in store.list_keys(PREFIX)
+
+    # Staging directories are cleaned up after upload
+    assert not list(output_dir.glob(".upload-*"))
+
+    # A newer upload that never completed is not resumed from
+    store.upload_file(str(tmp_path / "partial"), f"{PREFIX}/checkpoint-40/model.safetensors")
+
+    # A fresh machine downloads the latest complete checkpoint, without the marker
+    restarted = tmp_path / "restarted"
+    path = CheckpointManager(store, PREFIX, keep=2).restore_latest(str(restarted))
+
+    assert path == str(restarted / "checkpoint-30")
+    assert (restarted / "checkpoint-30" / "model.safetensors").read_bytes() == b"weights-30"
+    assert (restarted / "checkpoint-30" / "trainer_state.json").exists()
+    assert not (restarted / "checkpoint-30" / COMPLETE_MARKER).exists()
+
+
+def test_restore_prefers_newer_local_checkpoint(tmp_path, store):
+    output_dir = tmp_path / "output"
+    manager = CheckpointManager(store, PREFIX)
+
+    save(manager, output_dir, 10)
+    manager.wait()
+
+    # A newer complete local checkpoint wins over the store, an interrupted one is ignored
+    write_checkpoint(output_dir, 20)
+    write_checkpoint(output_dir, 30, complete=False)
+
+    assert manager.restore_latest(str(output_dir)) == str(output_dir / "checkpoint-20")
+
+
+def test_restore_without_checkpoints(tmp_path, store):
+    assert CheckpointManager(store, PREFIX).restore_latest(str(tmp_path / "output")) is None
+
+
+def test_dataset_cache(tmp_path, store):
+    tensors = {"input_ids": torch.arange(6).reshape(2, 3), "output_ids": torch.arange(6).reshape(2, 3) + 1}
+
+    manager = CheckpointManager(store, PREFIX)
+    assert manager.load_dataset(MANIFEST, str(tmp_path / "first")) is None
+
+    manager.save_dataset(MANIFEST, str(tmp_path / "first"), tensors)
+    manager.wait()
+
+    # A restarted job on a fresh machine gets the dataset from the store
+    cached = CheckpointManager(store, PREFIX).load_dataset(MANIFEST, str(tmp_path / "second"))
+    assert torch.equal(cached["input_ids"], tensors["input_ids"])
+    assert torch.equal(cached["output_ids"], tensors["output_ids"])
+
+    # A different manifest doesn't pick up this dataset
+    assert manager.load_dataset({**MANIFEST, "model_name": "distilgpt2"}, str(tmp_path / "third")) is None
+
+
+def test_truncated_dataset_cache_is_a_miss(tmp_path, store):
+    local_dir = tmp_path / "output"
+    local_dir.mkdir()
+    (local_dir / CheckpointManager.dataset_name(MANIFEST)).write_bytes(b"truncated")
+
+    assert CheckpointManager(store, PREFIX).load_dataset(MANIFEST, str(local_dir)) is None
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"model_name": "distilgpt2"},
+        {"lora": {"r": 8}},
+        {"sources": [{"user": "Cat", "logfile": "data/Cat_iMessage.txt", "type": "iMessage"}]},
+        {"training_args": {"output_dir": "./results", "save_total_limit": 2, "num_train_epochs": 5}},
+    ],
+)
+def test_changed_manifest_does_not_resume(tmp_path, changes):
+    output_dir = tmp_path / "output"
+
+    manager = from_manifest(tmp_path)
+    save(manager, output_dir, 10)
+    manager.wait()
+
+    # The same manifest resumes, from the local checkpoint or, on a fresh machine, from the store
+    assert from_manifest(tmp_path).restore_latest(str(output_dir)) == str(output_dir / "checkpoint-10")
+    fresh = tmp_path / "fresh"
+    assert from_manifest(tmp_path).restore_latest(str(fresh)) == str(fresh / "checkpoint-10")
+
+    # A changed manifest ignores both
+    assert from_manifest(tmp_path, **changes).restore_latest(str(output_dir)) is None
+
+
+def test_finished_run_trains_again(tmp_path):
+    output_dir = tmp_path / "output"
+    args = SimpleNamespace(output_dir=str(output_dir))
+
+    manager = from_manifest(tmp_path)
+    save(manager, output_dir, 10)
+    manager.on_train_end(args, SimpleNamespace(global_step=10), None)
+
+    # Running the finished job again starts from scratch, and its own checkpoints are resumed from after that
+    restarted = from_manifest(tmp_path)
+    assert restarted.restore_latest(str(output_dir)) is None
+    assert not (output_dir / "checkpoint-10").exists()
+
+    save(restarted, output_dir, 5)
+    restarted.wait()
+    fresh = tmp_path / "fresh"
+    assert from_manifest(tmp_path).restore_latest(str(fresh)) == str(fresh / "checkpoint-5")
+
+
+def test_epoch_saves_count_as_blocked(tmp_path, store):
+    output_dir = tmp_path / "output"
+    manager = CheckpointManager(store, PREFIX)
+
+    # With save_strategy "epoch", the save is only due after on_step_end
+    manager.on_step_end(None, None, SimpleNamespace(should_save=False))
+    manager.on_epoch_end(None, None, SimpleNamespace(should_save=True))
+    save(manager, output_dir, 10)
+    manager.wait()
+
+    assert manager.blocked_seconds > 0
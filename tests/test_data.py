@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+from echolalia.data import split_holdout
+
+
+@pytest.fixture
+def training_data():
+    # Two sources, concatenated one after the other, with interleaved reply times
+    return pd.DataFrame(
+        {
+            "input": ["a1", "a2", "a3", "b1", "b2", "b3"],
+            "output": ["A1", "A2", "A3", "B1", "B2", "B3"],
+            "timestamp": pd.to_datetime(
+                ["2023-01-01", "2023-01-03", "2023-01-05", "2023-01-02", "2023-01-04", "2023-01-06"]
+            ),
+        }
+    )
+
+
+def test_holdout_is_most_recent_across_sources(training_data):
+    train, held_out = split_holdout(training_data, 3)
+
+    assert train["input"].tolist() == ["a1", "b1", "a2"]
+    assert held_out["input"].tolist() == ["b2", "a3", "b3"]
+
+
+def test_no_holdout(training_data):
+    train, held_out = split_holdout(training_data, None)
+
+    assert len(train) == len(training_data)
+    assert held_out.empty
+
+
+@pytest.mark.parametrize("holdout", [-1, 6, 10])
+def test_holdout_out_of_range(training_data, holdout):
+    with pytest.raises(ValueError):
+        split_holdout(training_data, holdout)
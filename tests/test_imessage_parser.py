@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from echolalia.parser import iMessageParser
+
+FIXTURES = Path(__file__).parent / "fixtures" / "imessage"
+
+
+def parse(fixture: str) -> list[dict]:
+    """Parse a fixture log as if it had been downloaded from S3."""
+    chat_log = (FIXTURES / fixture).read_text()
+
+    parser = iMessageParser()
+    parser.download_chat_log = lambda bucket, chat_log_filename: chat_log
+
+    return parser.parse_chat_log(bucket="bucket", chat_log_filename=fixture).to_dict("records")
+
+
+def message(user: str, timestamps: list[str], text: str) -> dict:
+    return {
+        "user": user,
+        "timestamp": [pd.Timestamp(timestamp) for timestamp in timestamps],
+        "message": text,
+        "num_messages": len(timestamps),
+    }
+
+
+# Output of the previous (per-line re.search, string-appending) parser on the same fixtures
+@pytest.mark.parametrize(
+    "fixture, expected",
+    [
+        (
+            # A bare attachment is dropped, an attachment with a caption keeps the caption
+            "attachments.txt",
+            [
+                message("+14155550123", ["2023-01-02 15:05:00"], "look at this"),
+                message("Me", ["2023-01-03 00:00:30"], "ha nice"),
+            ],
+        ),
+        (
+            # Read receipts after the timestamp, and consecutive messages from one sender combined
+            "read_receipts.txt",
+            [
+                message("+14155550123", ["2021-03-21 11:12:41"], "are you around?"),
+                message(
+                    "Me", ["2021-03-21 12:01:00", "2021-03-21 12:02:30"], "yes sorry, was out just got back"
+                ),
+            ],
+        ),
+        (
+            # An indented reply in a thread is its own (dropped) message, and doesn't swallow its parent
+            "indented_replies.txt",
+            [
+                message("Me", ["2023-01-02 15:05:00"], "hello"),
+                message("+14155550123", ["2023-01-02 15:07:00"], "hi there"),
+            ],
+        ),
+    ],
+)
+def test_parity_with_previous_parser(fixture, expected):
+    assert parse(fixture) == expected
+
+
+def test_final_attachment_is_dropped():
+    # The previous parser skipped sanitizing the final message and kept the bare filename
+    assert parse("final_attachment.txt") == [message("+14155550123", ["2023-01-02 15:04:05"], "see you at 8")]
+
+
+def test_text_before_first_timestamp_is_ignored():
+    # The previous parser raised a TypeError here
+    expected = [message("+14155550123", ["2023-01-02 15:04:05"], "morning")]
+    assert parse("text_before_first_timestamp.txt") == expected
+
+
+def test_log_ending_after_timestamp():
+    # The previous parser raised StopIteration here. The cut-off message has no sender, so it is dropped
+    assert parse("ends_after_timestamp.txt") == [message("+14155550123", ["2023-01-02 15:04:05"], "morning")]
+
+
+def test_scan_output_is_columnar():
+    messages = iMessageParser().scan_chat_log((FIXTURES / "read_receipts.txt").read_text())
+
+    assert list(messages.columns) == ["timestamp", "user", "message", "exception"]
+    assert messages["timestamp"].dtype == "datetime64[ns]"
+    assert messages["message"].tolist() == ["are you around?", "yes sorry, was out", "just got back"]